@@ -1,15 +1,18 @@
+import asyncio
 import logging
 import sqlite3
 import json
 import os
-import random
+import shutil
 import calendar
 from datetime import time, datetime, timedelta
+from time import monotonic, time_ns
 import pytz
 from telegram import (
     Update, 
     InlineKeyboardButton, 
     InlineKeyboardMarkup,
+    KeyboardButton,
     ReplyKeyboardMarkup,
     ReplyKeyboardRemove
 )
@@ -24,6 +27,19 @@ from telegram.ext import (
 )
 from warnings import filterwarnings
 from telegram.warnings import PTBUserWarning
+from profiler import start_profiling
+from update_processor import PerUserUpdateProcessor
+from timezones import (
+    DEFAULT_TIMEZONE,
+    POPULAR_TIMEZONES,
+    find_timezones,
+    format_offset,
+    local_to_utc,
+    nearest_timezones,
+    resolve_timezone,
+    utc_now,
+    utc_to_local
+)
 
 filterwarnings(action="ignore", message=r".*CallbackQueryHandler", category=PTBUserWarning)
 
@@ -35,8 +51,12 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Константы
-SELECTING_TIME, SELECTING_TIMEZONE = range(2)
+SELECTING_TIME, SELECTING_TIMEZONE, SEARCHING_TIMEZONE = range(3)
 NAME, DATE_Q, TIME_Q, INFO, OPT = range(5)
+MAX_CONCURRENT_UPDATES = 256
+REMINDER_ID_EPOCH_MS = 1704067200000  # 2024-01-01 UTC
+reminder_id_state = {"last": 0}
+reminder_file_state = {"version": 0}  # растет при каждой записи reminder.json
 TIPS = [
     "Выключайте свет и электроприборы, когда они не используются",
     "Рационально используйте энергоресурсы",
@@ -51,9 +71,9 @@ TIPS = [
 ]
 
 # Инициализация баз данных
+# Общего курсора нет: каждый запрос получает свой через conn.execute
 conn = sqlite3.connect('users.db', check_same_thread=False)
-cursor = conn.cursor()
-cursor.execute('''
+conn.execute('''
     CREATE TABLE IF NOT EXISTS users (
         user_id INTEGER PRIMARY KEY,
         hour INTEGER,
@@ -63,12 +83,34 @@ cursor.execute('''
 ''')
 conn.commit()
 
+# Функции хранилища синхронные и не содержат await, поэтому в цикле событий
+# каждая из них выполняется целиком, не перемежаясь с другими обработчиками
+
 # ===== ФУНКЦИИ ДЛЯ НАПОМИНАНИЙ =====
 def init_json_file():
     default_data = {"напоминания": {}}
     if not os.path.exists("reminder.json"):
-        with open("reminder.json", "w", encoding='utf-8') as file:
-            json.dump(default_data, file, ensure_ascii=False, indent=4)
+        write_json_atomic(default_data)
+
+def dump_json(data, path):
+    with open(path, "w", encoding='utf-8') as file:
+        json.dump(data, file, ensure_ascii=False, indent=4)
+
+def write_json_atomic(data, path="reminder.json"):
+    tmp_path = path + ".tmp"
+    dump_json(data, tmp_path)
+    os.replace(tmp_path, path)
+    reminder_file_state["version"] += 1
+
+def load_reminders():
+    with open("reminder.json", "r", encoding='utf-8') as file:
+        return json.load(file)
+
+def next_reminder_id():
+    # Snowflake-идентификатор: миллисекунды от эпохи бота и счетчик в младших битах
+    candidate = (time_ns() // 1_000_000 - REMINDER_ID_EPOCH_MS) << 12
+    reminder_id_state["last"] = max(candidate, reminder_id_state["last"] + 1)
+    return reminder_id_state["last"]
 
 def json_editor(user_id, key, value):
     init_json_file()
@@ -91,8 +133,7 @@ def json_editor(user_id, key, value):
     
     data["напоминания"][user_id]["напоминания"][0][key] = value
     
-    with open("reminder.json", "w", encoding='utf-8') as file:
-        json.dump(data, file, ensure_ascii=False, indent=4)
+    write_json_atomic(data)
 
 def json_getter(user_id):
     init_json_file()
@@ -115,14 +156,21 @@ def json_getter(user_id):
             reminder["id"]
         )
 
-def get_user_timezone(user_id):
-    init_json_file()
-    try:
-        with open("reminder.json", "r", encoding='utf-8') as file:
-            data = json.load(file)
-            return data["напоминания"].get(str(user_id), {}).get("часовой_пояс", 0)
-    except (json.JSONDecodeError, KeyError):
-        return 0
+def get_user_timezone(user_id, stored=None):
+    # Выбранный в /vibrat пояс главнее старого смещения из reminder.json
+    row = conn.execute("SELECT timezone FROM users WHERE user_id = ?", (int(user_id),)).fetchone()
+    if row and row[0]:
+        return resolve_timezone(row[0])
+
+    if stored is None:
+        init_json_file()
+        try:
+            with open("reminder.json", "r", encoding='utf-8') as file:
+                data = json.load(file)
+                stored = data["напоминания"].get(str(user_id), {}).get("часовой_пояс", 0)
+        except (json.JSONDecodeError, KeyError):
+            stored = 0
+    return resolve_timezone(stored)
 
 def create_callback_data(action, *args):
     return ";".join([action] + [str(arg) for arg in args])
@@ -130,11 +178,11 @@ def create_callback_data(action, *args):
 def separate_callback_data(data):
     return data.split(";")
 
-def create_clock(tz_offset=0, hour=None, minute=None, period=None):
-    now = datetime.now()
+def create_clock(timezone=DEFAULT_TIMEZONE, hour=None, minute=None, period=None):
+    now = utc_to_local(utc_now(), timezone)
     
     if hour is None:
-        hour = (now.hour + tz_offset) % 24
+        hour = now.hour
         period = "pm" if hour >= 12 else "am"
         hour = hour % 12 or 12
         minute = (now.minute // 10) * 10
@@ -254,6 +302,152 @@ def process_calendar_selection(update, context):
     
     return False, None
 
+# ===== КОНТРОЛЬ НАГРУЗКИ =====
+USER_RATE = 1.0  # запросов в секунду на пользователя
+USER_BURST = 10
+# Нажатие на кнопку часов или календаря только меняет клавиатуру и стоит дешевле сообщения:
+# установка времени - до 16 нажатий подряд
+CALLBACK_COST = 0.25
+GLOBAL_RATE = 30.0  # запросов в секунду на весь бот
+GLOBAL_BURST = 60
+DUPLICATE_WINDOW = 1.0  # секунд, в течение которых одинаковые нажатия склеиваются
+THROTTLE_NOTICE_INTERVAL = 10.0  # не чаще одного ответа о лимите на пользователя
+MAX_TRACKED_USERS = 10000
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+
+# Корзина токенов: [оставшиеся токены, время последнего пополнения]
+user_buckets = {}
+global_bucket = [GLOBAL_BURST, monotonic()]
+recent_callbacks = {}
+throttle_notices = {}
+throttle_stats = {"admitted": 0, "throttled_user": 0, "throttled_global": 0, "coalesced": 0}
+
+def take_token(bucket, rate, burst, now, cost=1):
+    tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+    bucket[1] = now
+    if tokens < cost:
+        bucket[0] = tokens
+        return False
+    bucket[0] = tokens - cost
+    return True
+
+def forget_idle_users(now):
+    # Полностью пополнившиеся корзины ничем не отличаются от новых
+    idle_after = USER_BURST / USER_RATE
+    for user_id in [k for k, b in user_buckets.items() if now - b[1] > idle_after]:
+        del user_buckets[user_id]
+    for key in [k for k, seen in recent_callbacks.items() if now - seen > DUPLICATE_WINDOW]:
+        del recent_callbacks[key]
+    for user_id in [k for k, sent in throttle_notices.items() if now - sent > THROTTLE_NOTICE_INTERVAL]:
+        del throttle_notices[user_id]
+
+async def answer_callback(query, text=None):
+    # Ошибка ответа не должна помешать остановить обработку отклоненного нажатия
+    try:
+        await query.answer(text)
+    except Exception as e:
+        logger.warning(f"Error answering rejected callback: {e}")
+
+async def reject_update(update: Update):
+    if update.callback_query:
+        await answer_callback(update.callback_query, "⏳ Слишком много запросов, подождите немного")
+        return
+
+    # Отброшенное сообщение может быть ответом в диалоге - пользователь должен знать,
+    # что его нужно повторить. Отвечаем не чаще раза в THROTTLE_NOTICE_INTERVAL
+    user_id = update.effective_user.id
+    now = monotonic()
+    last_notice = throttle_notices.get(user_id)
+    if update.effective_message is None:
+        return
+    if last_notice is not None and now - last_notice < THROTTLE_NOTICE_INTERVAL:
+        return
+    throttle_notices[user_id] = now
+    try:
+        await update.effective_message.reply_text(
+            "⏳ Слишком много сообщений. Подождите немного и отправьте последнее сообщение еще раз."
+        )
+    except Exception as e:
+        logger.warning(f"Error replying to throttled message: {e}")
+
+async def admit_update(update):
+    # Вызывается PerUserUpdateProcessor до очереди пользователя и до лимита параллельности,
+    # поэтому отклоненные обновления не ждут за флудом и не занимают места
+    user = getattr(update, "effective_user", None)
+    if user is None:
+        return True
+
+    now = monotonic()
+    if max(len(user_buckets), len(recent_callbacks), len(throttle_notices)) > MAX_TRACKED_USERS:
+        forget_idle_users(now)
+
+    query = update.callback_query
+    if query:
+        message_id = query.message.message_id if query.message else None
+        key = (user.id, message_id, query.data)
+        seen = recent_callbacks.get(key)
+        recent_callbacks[key] = now
+        if seen is not None and now - seen < DUPLICATE_WINDOW:
+            throttle_stats["coalesced"] += 1
+            await answer_callback(query)
+            return False
+
+    cost = CALLBACK_COST if query else 1
+    bucket = user_buckets.setdefault(user.id, [USER_BURST, now])
+    if not take_token(bucket, USER_RATE, USER_BURST, now, cost):
+        throttle_stats["throttled_user"] += 1
+        await reject_update(update)
+        return False
+
+    if not take_token(global_bucket, GLOBAL_RATE, GLOBAL_BURST, now):
+        throttle_stats["throttled_global"] += 1
+        await reject_update(update)
+        return False
+
+    throttle_stats["admitted"] += 1
+    return True
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    lines = [f"{name}: {value}" for name, value in throttle_stats.items()]
+    lines.append(f"tracked_users: {len(user_buckets)}")
+    # Собственный счетчик процессора: current_concurrent_updates появился только в PTB 21.11
+    lines.append(f"in_flight: {context.application.update_processor.in_flight}")
+    await update.message.reply_text("📊 " + "\n".join(lines))
+
+# ===== ПРОФИЛИРОВАНИЕ =====
+# Функции, время которых выводится отдельно в отчете профилировщика
+TRACKED_CALLS = {
+    # хранилище
+    "json_editor",
+    "json_getter",
+    "get_user_timezone",
+    "write_json_atomic",
+    "load_reminders",
+    "save_user_time",
+    "compact_reminders_slice",
+    # клавиатуры и часовые пояса
+    "create_calendar",
+    "create_clock",
+    "timezone"  # pytz.timezone
+}
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in ADMIN_IDS:
+        return
+    try:
+        seconds = int(context.args[0]) if context.args else 30
+    except ValueError:
+        await update.message.reply_text("⛔ Использование: /profile [секунды]")
+        return
+
+    path = start_profiling(seconds, __file__, TRACKED_CALLS)
+    if path is None:
+        await update.message.reply_text("⏳ Профилирование уже идет.")
+        return
+    await update.message.reply_text(f"🔬 Профилирование запущено, результат: {path}.folded и {path}.txt")
+
 # ===== ОСНОВНЫЕ ФУНКЦИИ ЭКО-БОТА =====
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -278,30 +472,56 @@ async def set_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     
-    timezones = [
-        ["Москва (UTC+3)", "Europe/Moscow"],
-        ["Лондон (UTC+1)", "Europe/London"],
-        ["Нью-Йорк (UTC-4)", "America/New_York"],
-        ["Токио (UTC+9)", "Asia/Tokyo"]
-    ]
-    
     keyboard = []
-    for tz in timezones:
-        keyboard.append([InlineKeyboardButton(tz[0], callback_data=f"tz_{tz[1]}")])
+    for city, zone in POPULAR_TIMEZONES:
+        keyboard.append([InlineKeyboardButton(f"{city} ({format_offset(zone)})", callback_data=f"tz_{zone}")])
     
     await query.edit_message_text(
-        "Выбери свой часовой пояс:",
+        "Выбери свой часовой пояс или напиши название своего города:",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
-    return SELECTING_TIME
+    await context.bot.send_message(
+        chat_id=query.from_user.id,
+        text="📍 Можно также отправить геопозицию - я определю часовой пояс сам.",
+        reply_markup=ReplyKeyboardMarkup(
+            [[KeyboardButton("📍 Отправить геопозицию", request_location=True)]],
+            one_time_keyboard=True,
+            resize_keyboard=True
+        )
+    )
+    return SEARCHING_TIMEZONE
 
-async def handle_timezone_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
-    
-    timezone = query.data.split("_")[1]
-    context.user_data['timezone'] = timezone
-    
+async def search_timezone(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    zones = find_timezones(update.message.text)
+    if not zones:
+        await update.message.reply_text("🔍 Ничего не нашлось. Попробуй другой город (например, Москва или London).")
+        return SEARCHING_TIMEZONE
+
+    await update.message.reply_text(
+        "Выбери свой часовой пояс:",
+        reply_markup=timezone_keyboard(zones)
+    )
+    return SEARCHING_TIMEZONE
+
+async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # У границ ближайший город может быть в другом поясе, поэтому пользователь выбирает сам;
+    # клавиатура геопозиции убирается в handle_timezone_selection
+    location = update.message.location
+    zones = nearest_timezones(location.latitude, location.longitude)
+    await update.message.reply_text(
+        "🌍 Ближайшие часовые пояса - выбери свой:",
+        reply_markup=timezone_keyboard(zones)
+    )
+    return SEARCHING_TIMEZONE
+
+def timezone_keyboard(zones):
+    keyboard = [
+        [InlineKeyboardButton(f"{zone} ({format_offset(zone)})", callback_data=f"tz_{zone}")]
+        for zone in zones
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def tip_time_keyboard():
     keyboard = [
         [
             InlineKeyboardButton("08:00", callback_data="8_0"),
@@ -310,9 +530,24 @@ async def handle_timezone_selection(update: Update, context: ContextTypes.DEFAUL
         ],
         [InlineKeyboardButton("Другое время", callback_data="custom")]
     ]
+    return InlineKeyboardMarkup(keyboard)
+
+async def handle_timezone_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+    
+    timezone = query.data.split("_", 1)[1]
+    context.user_data['timezone'] = timezone
+    
+    # Убираем кнопку геопозиции, оставшуюся от set_timezone
+    await context.bot.send_message(
+        chat_id=query.from_user.id,
+        text=f"🌍 Твой часовой пояс: {timezone} ({format_offset(timezone)})",
+        reply_markup=ReplyKeyboardRemove()
+    )
     await query.edit_message_text(
         "Теперь выбери время для напоминания:",
-        reply_markup=InlineKeyboardMarkup(keyboard)
+        reply_markup=tip_time_keyboard()
     )
     return SELECTING_TIME
 
@@ -325,10 +560,13 @@ async def handle_time_selection(update: Update, context: ContextTypes.DEFAULT_TY
         return SELECTING_TIME
     else:
         hour, minute = map(int, query.data.split("_"))
-        timezone = context.user_data.get('timezone', 'Europe/Moscow')
+        timezone = context.user_data.get('timezone', DEFAULT_TIMEZONE)
         save_user_time(query.from_user.id, hour, minute, timezone)
-        await query.edit_message_text(
-            f"✅ Отлично! Буду присылать советы в {hour:02d}:{minute:02d} по часовому поясу {timezone}."
+        await query.edit_message_text(f"Вы выбрали: {hour:02d}:{minute:02d}")
+        await context.bot.send_message(
+            chat_id=query.from_user.id,
+            text=f"✅ Отлично! Буду присылать советы в {hour:02d}:{minute:02d} по часовому поясу {timezone}.",
+            reply_markup=ReplyKeyboardRemove()
         )
         await schedule_daily_tip(context, query.from_user.id, hour, minute, timezone)
         return ConversationHandler.END
@@ -338,7 +576,7 @@ async def handle_custom_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
         time_str = update.message.text
         hour, minute = map(int, time_str.split(":"))
         if 0 <= hour < 24 and 0 <= minute < 60:
-            timezone = context.user_data.get('timezone', 'Europe/Moscow')
+            timezone = context.user_data.get('timezone', DEFAULT_TIMEZONE)
             save_user_time(update.message.from_user.id, hour, minute, timezone)
             await update.message.reply_text(
                 f"✅ Отлично! Буду присылать советы в {hour:02d}:{minute:02d} по часовому поясу {timezone}."
@@ -353,11 +591,11 @@ async def handle_custom_time(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return SELECTING_TIME
 
 def save_user_time(user_id: int, hour: int, minute: int, timezone: str):
-    cursor.execute(
-        "INSERT OR REPLACE INTO users (user_id, hour, minute, timezone) VALUES (?, ?, ?, ?)",
-        (user_id, hour, minute, timezone)
-    )
-    conn.commit()
+    with conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO users (user_id, hour, minute, timezone) VALUES (?, ?, ?, ?)",
+            (user_id, hour, minute, timezone)
+        )
 
 async def schedule_daily_tip(context: ContextTypes.DEFAULT_TYPE, user_id: int, hour: int, minute: int, timezone: str):
     try:
@@ -367,35 +605,49 @@ async def schedule_daily_tip(context: ContextTypes.DEFAULT_TYPE, user_id: int, h
             job.schedule_removal()
 
         # Проверяем часовой пояс
-        try:
-            tz = pytz.timezone(timezone)
-        except pytz.exceptions.UnknownTimeZoneError:
-            tz = pytz.timezone('Europe/Moscow')
+        if resolve_timezone(timezone) != timezone:
             logger.warning(f"Unknown timezone {timezone} for user {user_id}, using default")
 
         # Добавляем новую задачу
-        context.job_queue.run_daily(
-            send_daily_tip,
-            time(hour, minute, tzinfo=tz),
-            chat_id=user_id,
-            name=str(user_id),
-            data={"user_id": user_id}
-        )
+        schedule_tip_job(context.job_queue, user_id, hour, minute, timezone)
         logger.info(f"Scheduled daily tip for user {user_id} at {hour:02d}:{minute:02d} {timezone}")
     except Exception as e:
         logger.error(f"Error scheduling tip for user {user_id}: {e}")
 
+def next_tip_time(hour, minute, timezone, now=None):
+    # Местное время переводится в UTC по таблице смещений; задача ставится на один запуск
+    # и после отправки переставляется, поэтому переход на летнее время учитывается сам
+    if now is None:
+        now = utc_now()
+    local_run = utc_to_local(now, timezone).replace(hour=hour, minute=minute, second=0, microsecond=0)
+    run_at = local_to_utc(local_run, timezone)
+    if run_at <= now:
+        run_at = local_to_utc(local_run + timedelta(days=1), timezone)
+    return run_at.replace(tzinfo=pytz.utc)
+
+def schedule_tip_job(job_queue, user_id, hour, minute, timezone):
+    job_queue.run_once(
+        send_daily_tip,
+        next_tip_time(hour, minute, timezone),
+        chat_id=user_id,
+        name=str(user_id),
+        data={"user_id": user_id}
+    )
+
 async def send_daily_tip(context: ContextTypes.DEFAULT_TYPE):
     job = context.job
     user_id = job.data["user_id"]
     
-    cursor.execute("SELECT hour, minute, timezone FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
+    row = conn.execute("SELECT hour, minute, timezone FROM users WHERE user_id = ?", (user_id,)).fetchone()
     
     if row:
         hour, minute, timezone = row
-        day_index = datetime.now(pytz.timezone(timezone)).timetuple().tm_yday
+        day_index = utc_to_local(utc_now(), timezone).timetuple().tm_yday
         tip = TIPS[day_index % len(TIPS)]
+
+        # Следующую задачу ставим до await: выполняемая задача уже снята с планировщика,
+        # и /vibrat во время отправки иначе не нашел бы ее и получилось бы две цепочки
+        schedule_tip_job(context.job_queue, user_id, hour, minute, timezone)
         
         try:
             await context.bot.send_message(chat_id=user_id, text=tip)
@@ -439,7 +691,7 @@ async def select_date(update: Update, context: ContextTypes.DEFAULT_TYPE):
             chat_id=query.from_user.id, 
             text="⏰ Выберите время:",
             parse_mode="Markdown", 
-            reply_markup=create_clock(tz_offset=tz)
+            reply_markup=create_clock(timezone=tz)
         )
         return TIME_Q
     return DATE_Q
@@ -451,7 +703,7 @@ async def select_time(update: Update, context: ContextTypes.DEFAULT_TYPE):
     selected, time = process_clock_selection(update, context)
     if selected:
         user_id = str(query.from_user.id)
-        r_id = random.randint(0, 100000)
+        r_id = next_reminder_id()
         formatted_time = f"{time[0]}:{time[1]:02d} {time[2]}"
         
         json_editor(user_id, "время", formatted_time)
@@ -494,6 +746,7 @@ async def save_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE, info
     
     if info:
         json_editor(user_id, "доп_инфо", info)
+    json_editor(user_id, "готово", True)
     
     reply_keyboard = [["/start", "/list"]]
     await update.message.reply_text(
@@ -504,14 +757,13 @@ async def save_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE, info
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.message.chat_id)
-    with open("reminder.json", "r+", encoding='utf-8') as file:
+    init_json_file()
+    with open("reminder.json", "r", encoding='utf-8') as file:
         data = json.load(file)
-        if "напоминания" in data and user_id in data["напоминания"]:
-            if data["напоминания"][user_id]["напоминания"]:
-                data["напоминания"][user_id]["напоминания"].pop(0)
-                file.seek(0)
-                json.dump(data, file, ensure_ascii=False, indent=4)
-                file.truncate()
+    if "напоминания" in data and user_id in data["напоминания"]:
+        if data["напоминания"][user_id]["напоминания"]:
+            data["напоминания"][user_id]["напоминания"].pop(0)
+            write_json_atomic(data)
     
     await update.message.reply_text(
         '❌ Создание напоминания отменено.',
@@ -519,6 +771,134 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ConversationHandler.END
 
+# ===== ОБСЛУЖИВАНИЕ ХРАНИЛИЩА =====
+BACKUP_DIR = "backups"
+BACKUPS_TO_KEEP = 7
+MAINTENANCE_SLICE = 50  # пользователей за один проход очистки
+MAINTENANCE_INTERVAL = 60  # секунд между проходами
+REMINDER_GRACE = timedelta(days=1)  # сколько хранить напоминание после его времени
+
+def parse_reminder_datetime(reminder):
+    try:
+        date = datetime.strptime(reminder["дата"], "%d/%m/%Y")
+        clock, period = reminder["время"].split()
+        hour, minute = map(int, clock.split(":"))
+    except (KeyError, ValueError, AttributeError):
+        return None
+    hour = hour % 12 + (12 if period == "pm" else 0)
+    return date.replace(hour=hour, minute=minute)
+
+def is_reminder_expired(reminder, timezone, now):
+    if reminder.get("доставлено"):
+        return True
+    when = parse_reminder_datetime(reminder)
+    if when is None:
+        return False
+    return local_to_utc(when, timezone) + REMINDER_GRACE < now
+
+def keep_reminder(index, reminder, timezone, now):
+    # Первое напоминание без отметки "готово" еще создается (диалог в INFO/OPT) -
+    # удалить его значит записать доп. информацию в чужое напоминание
+    if index == 0 and not reminder.get("готово"):
+        return True
+    if "id" not in reminder:
+        # Черновик без id живет, только пока он первый: следующий /reminder сдвигает
+        # брошенный черновик вниз, и там он уже никогда не будет дописан
+        return index == 0
+    return not is_reminder_expired(reminder, timezone, now)
+
+def compact_reminders_slice(data, offset, limit):
+    users = data.setdefault("напоминания", {})
+    user_ids = list(users)[offset:offset + limit]
+    now = utc_now()
+    removed = 0
+    dropped_users = 0
+
+    for user_id in user_ids:
+        entry = users[user_id]
+        tz_offset = entry.get("часовой_пояс", 0)
+        timezone = get_user_timezone(user_id, tz_offset)
+        reminders = entry.get("напоминания", [])
+        kept = [r for i, r in enumerate(reminders) if keep_reminder(i, r, timezone, now)]
+        removed += len(reminders) - len(kept)
+        entry["напоминания"] = kept
+
+        if not kept and not tz_offset:
+            del users[user_id]
+            dropped_users += 1
+
+    next_offset = offset + len(user_ids) - dropped_users
+    if next_offset >= len(users):
+        next_offset = 0
+    return next_offset, removed, bool(removed or dropped_users)
+
+def backup_database(path):
+    # Отдельные соединения: бэкап идет в потоке и не блокирует обработчики
+    source = sqlite3.connect('users.db')
+    target = sqlite3.connect(path)
+    try:
+        source.backup(target, pages=64, sleep=0.01)
+    finally:
+        target.close()
+        source.close()
+
+def vacuum_database():
+    db = sqlite3.connect('users.db')
+    try:
+        db.execute("VACUUM")
+    finally:
+        db.close()
+
+def prune_backups():
+    for prefix in ("users_", "reminder_"):
+        snapshots = sorted(f for f in os.listdir(BACKUP_DIR) if f.startswith(prefix))
+        for name in snapshots[:-BACKUPS_TO_KEEP]:
+            os.remove(os.path.join(BACKUP_DIR, name))
+
+async def storage_maintenance(context: ContextTypes.DEFAULT_TYPE):
+    # Чтение и запись файла идут в потоке, в цикле событий остаются только фильтрация
+    # и os.replace. Если обработчик успел записать файл, проход откладывается
+    offset = context.bot_data.get("maintenance_offset", 0)
+    compact_path = "reminder.json.compact"
+    try:
+        init_json_file()
+        version = reminder_file_state["version"]
+        data = await asyncio.to_thread(load_reminders)
+        next_offset, removed, changed = compact_reminders_slice(data, offset, MAINTENANCE_SLICE)
+
+        if changed:
+            await asyncio.to_thread(dump_json, data, compact_path)
+            if reminder_file_state["version"] != version:
+                os.remove(compact_path)
+                logger.info("reminder.json changed during compaction, retrying later")
+                return
+            os.replace(compact_path, "reminder.json")
+            reminder_file_state["version"] += 1
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Error compacting reminders: {e}")
+        return
+
+    context.bot_data["maintenance_offset"] = next_offset
+    if removed:
+        logger.info(f"Removed {removed} expired reminders")
+
+async def storage_snapshot(context: ContextTypes.DEFAULT_TYPE):
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    stamp = utc_now().strftime("%Y%m%d_%H%M%S")
+    try:
+        # reminder.json заменяется атомарно, поэтому копия из потока всегда согласована
+        init_json_file()
+        await asyncio.to_thread(
+            shutil.copyfile, "reminder.json", os.path.join(BACKUP_DIR, f"reminder_{stamp}.json")
+        )
+
+        await asyncio.to_thread(vacuum_database)
+        await asyncio.to_thread(backup_database, os.path.join(BACKUP_DIR, f"users_{stamp}.db"))
+        prune_backups()
+        logger.info(f"Storage snapshot {stamp} created")
+    except (OSError, sqlite3.Error) as e:
+        logger.error(f"Error creating storage snapshot: {e}")
+
 # ===== ИНФОРМАЦИОННЫЕ КОМАНДЫ =====
 async def globalwarming(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -551,13 +931,23 @@ async def why(update: Update, context: ContextTypes.DEFAULT_TYPE):
 def main():
     try:
         # Создаем Application
-        application = Application.builder().token("ТОКЕН").build()
+        application = (
+            Application.builder()
+            .token("ТОКЕН")
+            .concurrent_updates(PerUserUpdateProcessor(MAX_CONCURRENT_UPDATES, admit=admit_update))
+            .build()
+        )
 
         # Обработчик выбора времени и часового пояса для эко-советов
         eco_conv_handler = ConversationHandler(
             entry_points=[CommandHandler('vibrat', vibrat)],
             states={
                 SELECTING_TIMEZONE: [CallbackQueryHandler(set_timezone)],
+                SEARCHING_TIMEZONE: [
+                    CallbackQueryHandler(handle_timezone_selection, pattern="^tz_"),
+                    MessageHandler(filters.LOCATION, handle_location),
+                    MessageHandler(filters.TEXT & ~filters.COMMAND, search_timezone)
+                ],
                 SELECTING_TIME: [
                     CallbackQueryHandler(handle_timezone_selection, pattern="^tz_"),
                     CallbackQueryHandler(handle_time_selection),
@@ -585,26 +975,43 @@ def main():
         application.add_handler(CommandHandler("globalwarming", globalwarming))
         application.add_handler(CommandHandler("what", what))
         application.add_handler(CommandHandler("why", why))
+        application.add_handler(CommandHandler("stats", stats))
+        application.add_handler(CommandHandler("profile", profile))
         application.add_handler(eco_conv_handler)
         application.add_handler(reminder_conv_handler)
 
         # Восстановление расписания из БД
-        cursor.execute("SELECT user_id, hour, minute, timezone FROM users")
-        for row in cursor.fetchall():
+        for row in conn.execute("SELECT user_id, hour, minute, timezone FROM users").fetchall():
             user_id, hour, minute, timezone = row
             try:
-                tz = pytz.timezone(timezone)
-                application.job_queue.run_daily(
-                    send_daily_tip,
-                    time(hour, minute, tzinfo=tz),
-                    chat_id=user_id,
-                    name=str(user_id),
-                    data={"user_id": user_id}
-                )
+                schedule_tip_job(application.job_queue, user_id, hour, minute, timezone)
                 logger.info(f"Restored schedule for user {user_id} at {hour:02d}:{minute:02d} {timezone}")
             except Exception as e:
                 logger.error(f"Error restoring schedule for user {user_id}: {e}")
 
+        # Обслуживание хранилища: очистка напоминаний небольшими порциями и ежедневный снимок
+        application.job_queue.run_repeating(
+            storage_maintenance,
+            interval=MAINTENANCE_INTERVAL,
+            first=MAINTENANCE_INTERVAL,
+            name="storage_maintenance"
+        )
+        application.job_queue.run_daily(
+            storage_snapshot,
+            time(3, 0, tzinfo=pytz.utc),
+            name="storage_snapshot"
+        )
+
+        # Профилирование с первых секунд работы, если задано PROFILE_SECONDS
+        try:
+            profile_seconds = int(os.getenv("PROFILE_SECONDS", "0"))
+        except ValueError:
+            logger.warning(f"Invalid PROFILE_SECONDS={os.getenv('PROFILE_SECONDS')!r}, profiling disabled")
+            profile_seconds = 0
+        if profile_seconds > 0:
+            path = start_profiling(profile_seconds, __file__, TRACKED_CALLS)
+            logger.info(f"Profiling for {profile_seconds}s into {path}")
+
         # Запуск бота
         logger.info("Starting bot...")
         application.run_polling()
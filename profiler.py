@@ -0,0 +1,98 @@
+import os
+import sys
+import threading
+from collections import Counter
+from inspect import CO_COROUTINE
+from time import monotonic, sleep
+from timezones import utc_now
+
+PROFILE_DIR = "profiles"
+SAMPLE_INTERVAL = 0.005  # секунд между снимками стека
+MAX_PROFILE_SECONDS = 300
+
+profiler_state = {"thread": None}
+
+def is_profiling():
+    thread = profiler_state["thread"]
+    return thread is not None and thread.is_alive()
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def find_handler(stack, source_file):
+    # Обработчик - самая глубокая корутина бота, которую вызвал чужой код (PTB или JobQueue).
+    # Самая внешняя не подходит: обертки вроде процессора обновлений вызывают PTB, а уже
+    # он - сам обработчик. Корутины, вызванные из обработчика, к нему и относятся
+    handler = "<idle>"
+    for caller, frame in zip(stack, stack[1:]):
+        code = frame.f_code
+        if (code.co_filename == source_file and code.co_flags & CO_COROUTINE
+                and caller.f_code.co_filename != source_file):
+            handler = code.co_name
+    return handler
+
+def sample_loop(thread_id, seconds, source_file, tracked_calls, path):
+    stacks = Counter()
+    handlers = Counter()
+    tracked = Counter()
+    samples = 0
+    started = monotonic()
+    deadline = started + seconds
+
+    while monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(frame)
+            frame = frame.f_back
+        stack.reverse()
+
+        handler = find_handler(stack, source_file)
+        call = next((f.f_code.co_name for f in reversed(stack) if f.f_code.co_name in tracked_calls), None)
+
+        stacks[";".join(frame_name(f) for f in stack)] += 1
+        handlers[handler] += 1
+        if call:
+            tracked[(handler, call)] += 1
+        samples += 1
+        sleep(SAMPLE_INTERVAL)
+
+    write_profile(path, stacks, handlers, tracked, samples, monotonic() - started)
+
+def write_profile(path, stacks, handlers, tracked, samples, elapsed):
+    # Реальный шаг больше SAMPLE_INTERVAL на время снятия стека, поэтому делим фактическое время
+    sample_ms = elapsed * 1000 / max(samples, 1)
+    # Формат collapsed stacks понимают flamegraph.pl и speedscope
+    with open(path + ".folded", "w", encoding='utf-8') as file:
+        for stack, count in stacks.most_common():
+            file.write(f"{stack} {count}\n")
+
+    with open(path + ".txt", "w", encoding='utf-8') as file:
+        file.write(f"samples: {samples}, elapsed: {elapsed:.1f} s\n\n")
+        file.write("handlers:\n")
+        for handler, count in handlers.most_common():
+            file.write(f"  {handler}: {count * sample_ms:.0f} ms ({count / max(samples, 1):.1%})\n")
+        file.write("\ntracked calls:\n")
+        for (handler, call), count in tracked.most_common():
+            file.write(f"  {handler} -> {call}: {count * sample_ms:.0f} ms\n")
+
+def start_profiling(seconds, source_file, tracked_calls, thread_id=None):
+    if is_profiling():
+        return None
+
+    if thread_id is None:
+        thread_id = threading.main_thread().ident
+    seconds = max(1, min(seconds, MAX_PROFILE_SECONDS))
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, utc_now().strftime("profile_%Y%m%d_%H%M%S"))
+
+    thread = threading.Thread(
+        target=sample_loop,
+        args=(thread_id, seconds, source_file, frozenset(tracked_calls), path),
+        name="profiler",
+        daemon=True
+    )
+    profiler_state["thread"] = thread
+    thread.start()
+    return path
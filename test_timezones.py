@@ -0,0 +1,141 @@
+import importlib
+from datetime import datetime, timedelta
+import pytest
+import pytz
+from timezones import (
+    CITY_ALIASES,
+    CITY_LOCATIONS,
+    DEFAULT_TIMEZONE,
+    find_timezones,
+    get_zone,
+    local_to_utc,
+    nearest_timezones,
+    resolve_timezone,
+    utc_to_local
+)
+
+ZONES = [
+    "Europe/Moscow",
+    "Europe/London",
+    "America/New_York",
+    "Australia/Sydney",
+    "America/Santiago",
+    "Asia/Kolkata",
+    "Etc/GMT-3",
+    "UTC"
+]
+
+def transitions(name, start=datetime(2000, 1, 1), end=datetime(2035, 1, 1)):
+    tz = pytz.timezone(name)
+    return [t for t in getattr(tz, "_utc_transition_times", []) if start <= t < end]
+
+def pytz_local(utc_dt, name):
+    return pytz.utc.localize(utc_dt).astimezone(pytz.timezone(name)).replace(tzinfo=None)
+
+@pytest.mark.parametrize("name", ZONES)
+def test_utc_to_local_matches_pytz_around_transitions(name):
+    points = [datetime(2020, 1, 1), datetime(2020, 7, 1)]
+    for transition in transitions(name):
+        points += [transition + timedelta(seconds=s) for s in (-3600, -1, 0, 1, 3600)]
+
+    for utc_dt in points:
+        assert utc_to_local(utc_dt, name) == pytz_local(utc_dt, name), utc_dt
+
+@pytest.mark.parametrize("name", ZONES)
+def test_local_to_utc_matches_pytz_localize(name):
+    tz = pytz.timezone(name)
+    for transition in transitions(name) or [datetime(2020, 1, 1)]:
+        local_transition = pytz_local(transition, name)
+        for minutes in range(-180, 181, 30):
+            local_dt = local_transition + timedelta(minutes=minutes)
+            try:
+                expected = tz.localize(local_dt, is_dst=None)
+            except (pytz.AmbiguousTimeError, pytz.NonExistentTimeError):
+                continue
+            assert local_to_utc(local_dt, name) == expected.astimezone(pytz.utc).replace(tzinfo=None), local_dt
+
+def test_local_to_utc_in_dst_gap_uses_offset_before_transition():
+    # 02:30 8 марта 2026 в Нью-Йорке не существует
+    tz = pytz.timezone("America/New_York")
+    local_dt = datetime(2026, 3, 8, 2, 30)
+    expected = tz.localize(local_dt, is_dst=False).astimezone(pytz.utc).replace(tzinfo=None)
+    assert local_to_utc(local_dt, "America/New_York") == expected == datetime(2026, 3, 8, 7, 30)
+
+def test_local_to_utc_in_dst_overlap_uses_offset_after_transition():
+    # 01:30 1 ноября 2026 в Нью-Йорке бывает дважды - берется второе, зимнее
+    tz = pytz.timezone("America/New_York")
+    local_dt = datetime(2026, 11, 1, 1, 30)
+    expected = tz.localize(local_dt, is_dst=False).astimezone(pytz.utc).replace(tzinfo=None)
+    assert local_to_utc(local_dt, "America/New_York") == expected == datetime(2026, 11, 1, 6, 30)
+
+@pytest.mark.parametrize("value, expected", [
+    (3, "Etc/GMT-3"),
+    (-5, "Etc/GMT+5"),
+    (14, "Etc/GMT-14"),
+    (-12, "Etc/GMT+12"),
+    (0, DEFAULT_TIMEZONE),
+    (15, DEFAULT_TIMEZONE),
+    (-13, DEFAULT_TIMEZONE),
+    (True, DEFAULT_TIMEZONE),
+    (None, DEFAULT_TIMEZONE),
+    ("Asia/Tokyo", "Asia/Tokyo"),
+    ("Mars/Olympus", DEFAULT_TIMEZONE)
+])
+def test_resolve_timezone(value, expected):
+    assert resolve_timezone(value) == expected
+    assert get_zone(value).zone == expected
+
+def test_legacy_offset_table_is_constant():
+    assert utc_to_local(datetime(2026, 6, 1, 12), 3) == datetime(2026, 6, 1, 15)
+    assert local_to_utc(datetime(2026, 6, 1, 15), 3) == datetime(2026, 6, 1, 12)
+
+def test_city_aliases_point_to_known_zones():
+    zones = [zone for _, zone, _, _ in CITY_LOCATIONS] + list(CITY_ALIASES.values())
+    assert all(zone in pytz.all_timezones_set for zone in zones)
+
+@pytest.mark.parametrize("query, zone", [
+    ("Сочи", "Europe/Moscow"),
+    ("пермь", "Asia/Yekaterinburg"),
+    ("Орёл", "Europe/Moscow"),
+    ("new y", "America/New_York"),
+    ("  London ", "Europe/London")
+])
+def test_find_timezones(query, zone):
+    assert zone in find_timezones(query)
+
+def test_find_timezones_empty_or_unknown():
+    assert find_timezones("   ") == []
+    assert find_timezones("zzzz") == []
+
+@pytest.mark.parametrize("latitude, longitude, zone", [
+    (43.60, 39.73, "Europe/Moscow"),  # Сочи
+    (51.73, 36.19, "Europe/Moscow"),  # Курск
+    (57.82, 28.33, "Europe/Moscow"),  # Псков
+    (51.17, 71.43, "Asia/Almaty"),  # Астана
+    (40.71, -74.01, "America/New_York")
+])
+def test_nearest_timezones_ranks_local_zone_first(latitude, longitude, zone):
+    candidates = nearest_timezones(latitude, longitude)
+    assert candidates[0] == zone
+    assert len(candidates) == len(set(candidates)) == 5
+
+@pytest.fixture
+def main_module(tmp_path, monkeypatch):
+    # main открывает users.db в текущем каталоге при импорте
+    monkeypatch.chdir(tmp_path)
+    return importlib.import_module("main")
+
+@pytest.mark.parametrize("now, expected", [
+    (datetime(2026, 10, 19, 4, 0), datetime(2026, 10, 19, 5, 0)),
+    (datetime(2026, 10, 19, 5, 0), datetime(2026, 10, 20, 5, 0)),
+    (datetime(2026, 10, 19, 6, 0), datetime(2026, 10, 20, 5, 0))
+])
+def test_next_tip_time_moscow(main_module, now, expected):
+    assert main_module.next_tip_time(8, 0, "Europe/Moscow", now) == pytz.utc.localize(expected)
+
+def test_next_tip_time_across_dst_switch(main_module):
+    # 7 марта 08:00 в Нью-Йорке - UTC-5, 8 марта - уже UTC-4
+    assert main_module.next_tip_time(8, 0, "America/New_York", datetime(2026, 3, 7, 12, 0)) == \
+        pytz.utc.localize(datetime(2026, 3, 7, 13, 0))
+    assert main_module.next_tip_time(8, 0, "America/New_York", datetime(2026, 3, 7, 14, 0)) == \
+        pytz.utc.localize(datetime(2026, 3, 8, 12, 0))
@@ -0,0 +1,65 @@
+import asyncio
+from time import monotonic
+from types import SimpleNamespace
+from update_processor import PerUserUpdateProcessor
+
+def make_update(user_id):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+
+async def work(finished, name, started, seconds=0.1):
+    await asyncio.sleep(seconds)
+    finished[name] = monotonic() - started
+
+def test_flooding_user_does_not_delay_other_users():
+    async def scenario():
+        processor = PerUserUpdateProcessor(4)
+        finished = {}
+        started = monotonic()
+        tasks = [
+            asyncio.create_task(processor.process_update(make_update(1), work(finished, f"flood{i}", started)))
+            for i in range(8)
+        ]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(processor.process_update(make_update(2), work(finished, "other", started))))
+        await asyncio.gather(*tasks)
+        return finished
+
+    finished = asyncio.run(scenario())
+    assert finished["other"] < 0.2
+    # Обновления одного пользователя по-прежнему выполняются по очереди
+    assert finished["flood7"] >= 0.8
+
+def test_concurrency_limit_applies_across_users():
+    async def scenario():
+        processor = PerUserUpdateProcessor(2)
+        peak = 0
+
+        async def tracked():
+            nonlocal peak
+            peak = max(peak, processor.in_flight)
+            await asyncio.sleep(0.05)
+
+        await asyncio.gather(*(processor.process_update(make_update(i), tracked()) for i in range(6)))
+        return peak, processor.in_flight, processor.user_locks
+
+    peak, in_flight, user_locks = asyncio.run(scenario())
+    assert peak == 2
+    assert in_flight == 0
+    assert user_locks == {}
+
+def test_rejected_update_is_not_processed():
+    async def scenario():
+        ran = []
+
+        async def admit(update):
+            return update.effective_user.id != 1
+
+        async def handler(user_id):
+            ran.append(user_id)
+
+        processor = PerUserUpdateProcessor(4, admit=admit)
+        await processor.process_update(make_update(1), handler(1))
+        await processor.process_update(make_update(2), handler(2))
+        return ran
+
+    assert asyncio.run(scenario()) == [2]
@@ -0,0 +1,245 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from functools import lru_cache
+from math import cos, radians
+import pytz
+
+DEFAULT_TIMEZONE = "Europe/Moscow"
+
+POPULAR_TIMEZONES = [
+    ["Москва", "Europe/Moscow"],
+    ["Лондон", "Europe/London"],
+    ["Нью-Йорк", "America/New_York"],
+    ["Токио", "Asia/Tokyo"]
+]
+
+# Российские региональные центры и столицы соседних стран: название, зона, широта, долгота.
+# Нужны и для поиска по-русски, и для геопозиции - главных городов из zone.tab у границ мало
+CITY_LOCATIONS = [
+    ("москва", "Europe/Moscow", 55.76, 37.62),
+    ("санкт-петербург", "Europe/Moscow", 59.94, 30.31),
+    ("казань", "Europe/Moscow", 55.79, 49.12),
+    ("нижний новгород", "Europe/Moscow", 56.33, 44.00),
+    ("сочи", "Europe/Moscow", 43.59, 39.73),
+    ("краснодар", "Europe/Moscow", 45.04, 38.98),
+    ("ростов-на-дону", "Europe/Moscow", 47.24, 39.71),
+    ("воронеж", "Europe/Moscow", 51.67, 39.18),
+    ("курск", "Europe/Moscow", 51.73, 36.19),
+    ("белгород", "Europe/Moscow", 50.60, 36.59),
+    ("брянск", "Europe/Moscow", 53.24, 34.36),
+    ("орел", "Europe/Moscow", 52.97, 36.07),
+    ("липецк", "Europe/Moscow", 52.61, 39.59),
+    ("тамбов", "Europe/Moscow", 52.72, 41.45),
+    ("рязань", "Europe/Moscow", 54.63, 39.74),
+    ("тула", "Europe/Moscow", 54.19, 37.62),
+    ("калуга", "Europe/Moscow", 54.51, 36.26),
+    ("смоленск", "Europe/Moscow", 54.78, 32.04),
+    ("тверь", "Europe/Moscow", 56.86, 35.90),
+    ("ярославль", "Europe/Moscow", 57.63, 39.87),
+    ("кострома", "Europe/Moscow", 57.77, 40.93),
+    ("иваново", "Europe/Moscow", 57.00, 40.97),
+    ("владимир", "Europe/Moscow", 56.13, 40.41),
+    ("псков", "Europe/Moscow", 57.82, 28.33),
+    ("великий новгород", "Europe/Moscow", 58.52, 31.27),
+    ("петрозаводск", "Europe/Moscow", 61.79, 34.36),
+    ("мурманск", "Europe/Moscow", 68.97, 33.07),
+    ("архангельск", "Europe/Moscow", 64.54, 40.54),
+    ("вологда", "Europe/Moscow", 59.22, 39.89),
+    ("сыктывкар", "Europe/Moscow", 61.67, 50.84),
+    ("нарьян-мар", "Europe/Moscow", 67.64, 53.01),
+    ("пенза", "Europe/Moscow", 53.20, 45.00),
+    ("саранск", "Europe/Moscow", 54.19, 45.18),
+    ("чебоксары", "Europe/Moscow", 56.15, 47.25),
+    ("йошкар-ола", "Europe/Moscow", 56.63, 47.89),
+    ("ставрополь", "Europe/Moscow", 45.04, 41.97),
+    ("майкоп", "Europe/Moscow", 44.61, 40.10),
+    ("черкесск", "Europe/Moscow", 44.23, 42.06),
+    ("нальчик", "Europe/Moscow", 43.49, 43.61),
+    ("владикавказ", "Europe/Moscow", 43.02, 44.68),
+    ("магас", "Europe/Moscow", 43.17, 44.81),
+    ("грозный", "Europe/Moscow", 43.32, 45.69),
+    ("махачкала", "Europe/Moscow", 42.98, 47.50),
+    ("элиста", "Europe/Moscow", 46.31, 44.26),
+    ("киров", "Europe/Kirov", 58.60, 49.66),
+    ("симферополь", "Europe/Simferopol", 44.95, 34.10),
+    ("севастополь", "Europe/Simferopol", 44.62, 33.53),
+    ("калининград", "Europe/Kaliningrad", 54.71, 20.51),
+    ("волгоград", "Europe/Volgograd", 48.71, 44.51),
+    ("астрахань", "Europe/Astrakhan", 46.35, 48.04),
+    ("саратов", "Europe/Saratov", 51.53, 46.03),
+    ("ульяновск", "Europe/Ulyanovsk", 54.32, 48.40),
+    ("самара", "Europe/Samara", 53.20, 50.15),
+    ("тольятти", "Europe/Samara", 53.51, 49.42),
+    ("ижевск", "Europe/Samara", 56.85, 53.20),
+    ("екатеринбург", "Asia/Yekaterinburg", 56.84, 60.61),
+    ("челябинск", "Asia/Yekaterinburg", 55.16, 61.40),
+    ("пермь", "Asia/Yekaterinburg", 58.01, 56.25),
+    ("уфа", "Asia/Yekaterinburg", 54.73, 55.96),
+    ("оренбург", "Asia/Yekaterinburg", 51.77, 55.10),
+    ("тюмень", "Asia/Yekaterinburg", 57.15, 65.53),
+    ("курган", "Asia/Yekaterinburg", 55.44, 65.34),
+    ("ханты-мансийск", "Asia/Yekaterinburg", 61.00, 69.02),
+    ("сургут", "Asia/Yekaterinburg", 61.25, 73.40),
+    ("салехард", "Asia/Yekaterinburg", 66.53, 66.61),
+    ("омск", "Asia/Omsk", 54.99, 73.37),
+    ("новосибирск", "Asia/Novosibirsk", 55.03, 82.92),
+    ("барнаул", "Asia/Barnaul", 53.35, 83.78),
+    ("горно-алтайск", "Asia/Barnaul", 51.96, 85.96),
+    ("томск", "Asia/Tomsk", 56.48, 84.95),
+    ("кемерово", "Asia/Novokuznetsk", 55.35, 86.09),
+    ("новокузнецк", "Asia/Novokuznetsk", 53.76, 87.14),
+    ("красноярск", "Asia/Krasnoyarsk", 56.01, 92.85),
+    ("абакан", "Asia/Krasnoyarsk", 53.72, 91.44),
+    ("кызыл", "Asia/Krasnoyarsk", 51.72, 94.45),
+    ("иркутск", "Asia/Irkutsk", 52.29, 104.28),
+    ("улан-удэ", "Asia/Irkutsk", 51.83, 107.58),
+    ("чита", "Asia/Chita", 52.03, 113.50),
+    ("якутск", "Asia/Yakutsk", 62.03, 129.73),
+    ("благовещенск", "Asia/Yakutsk", 50.29, 127.53),
+    ("владивосток", "Asia/Vladivostok", 43.12, 131.89),
+    ("хабаровск", "Asia/Vladivostok", 48.48, 135.08),
+    ("биробиджан", "Asia/Vladivostok", 48.79, 132.92),
+    ("южно-сахалинск", "Asia/Sakhalin", 46.96, 142.74),
+    ("магадан", "Asia/Magadan", 59.57, 150.80),
+    ("петропавловск-камчатский", "Asia/Kamchatka", 53.02, 158.65),
+    ("анадырь", "Asia/Anadyr", 64.73, 177.51),
+    ("минск", "Europe/Minsk", 53.90, 27.56),
+    ("киев", "Europe/Kyiv", 50.45, 30.52),
+    ("астана", "Asia/Almaty", 51.17, 71.43),
+    ("алматы", "Asia/Almaty", 43.24, 76.89),
+    ("ташкент", "Asia/Tashkent", 41.30, 69.24),
+    ("бишкек", "Asia/Bishkek", 42.87, 74.59),
+    ("тбилиси", "Asia/Tbilisi", 41.72, 44.79),
+    ("ереван", "Asia/Yerevan", 40.18, 44.51),
+    ("баку", "Asia/Baku", 40.41, 49.87)
+]
+
+# Русские названия прочих городов, которых нет в английских именах зон IANA
+CITY_ALIASES = {
+    "камчатка": "Asia/Kamchatka",
+    "лондон": "Europe/London",
+    "берлин": "Europe/Berlin",
+    "париж": "Europe/Paris",
+    "нью-йорк": "America/New_York",
+    "лос-анджелес": "America/Los_Angeles",
+    "токио": "Asia/Tokyo",
+    "пекин": "Asia/Shanghai",
+    "дубай": "Asia/Dubai"
+}
+
+def resolve_timezone(value):
+    # Старые записи хранят часовой пояс целым смещением в часах;
+    # зоны Etc/GMT существуют только для смещений от -12 до +14
+    if isinstance(value, int) and not isinstance(value, bool):
+        if not value or not -12 <= value <= 14:
+            return DEFAULT_TIMEZONE
+        return f"Etc/GMT{-value:+d}"
+    if value in pytz.all_timezones_set:
+        return value
+    return DEFAULT_TIMEZONE
+
+def utc_now():
+    # Наивное время UTC, как в таблицах смещений; datetime.utcnow устарел с Python 3.12
+    return datetime.now(pytz.utc).replace(tzinfo=None)
+
+@lru_cache(maxsize=None)
+def get_zone(name):
+    return pytz.timezone(resolve_timezone(name))
+
+# ===== ТАБЛИЦЫ СМЕЩЕНИЙ =====
+@lru_cache(maxsize=None)
+def offset_table(name):
+    tz = get_zone(name)
+    utc_starts = getattr(tz, "_utc_transition_times", None)
+    if not utc_starts:
+        return [datetime.min], [tz.utcoffset(None)], [datetime.min]
+
+    offsets = [info[0] for info in tz._transition_info]
+    # Первый переход - datetime.min, к нему нельзя прибавить отрицательное смещение
+    local_starts = [datetime.min] + [t + o for t, o in zip(utc_starts[1:], offsets[1:])]
+    return utc_starts, offsets, local_starts
+
+def utc_to_local(utc_dt, name):
+    utc_starts, offsets, _ = offset_table(name)
+    return utc_dt + offsets[bisect_right(utc_starts, utc_dt) - 1]
+
+def local_to_utc(local_dt, name):
+    _, offsets, local_starts = offset_table(name)
+    return local_dt - offsets[bisect_right(local_starts, local_dt) - 1]
+
+def format_offset(name, now=None):
+    if now is None:
+        now = utc_now()
+    minutes = int((utc_to_local(now, name) - now).total_seconds() // 60)
+    sign = "+" if minutes >= 0 else "-"
+    hours, minutes = divmod(abs(minutes), 60)
+    return f"UTC{sign}{hours}" + (f":{minutes:02d}" if minutes else "")
+
+# ===== ПОИСК ПО ГОРОДУ =====
+@lru_cache(maxsize=None)
+def city_index():
+    index = [(city, zone) for city, zone, _, _ in CITY_LOCATIONS]
+    index.extend(CITY_ALIASES.items())
+    for zone in pytz.common_timezones:
+        city = zone.rsplit("/", 1)[-1].replace("_", " ").lower()
+        index.append((city, zone))
+    index.sort()
+    return index
+
+def find_timezones(query, limit=8):
+    prefix = query.strip().lower().replace("ё", "е")
+    if not prefix:
+        return []
+
+    index = city_index()
+    found = []
+    for city, zone in index[bisect_left(index, (prefix,)):]:
+        if not city.startswith(prefix) or len(found) >= limit:
+            break
+        if zone not in found:
+            found.append(zone)
+    return found
+
+# ===== ПОИСК ПО ГЕОПОЗИЦИИ =====
+def parse_coordinate(text, degree_digits):
+    sign = -1 if text[0] == "-" else 1
+    digits = text[1:]
+    value = int(digits[:degree_digits]) + int(digits[degree_digits:degree_digits + 2]) / 60
+    if len(digits) > degree_digits + 2:
+        value += int(digits[degree_digits + 2:]) / 3600
+    return sign * value
+
+@lru_cache(maxsize=None)
+def zone_locations():
+    # zone.tab поставляется вместе с pytz: у каждой зоны есть координаты главного города
+    locations = []
+    with pytz.open_resource("zone.tab") as file:
+        for line in file.read().decode("utf-8").splitlines():
+            if line.startswith("#"):
+                continue
+            fields = line.split("\t")
+            if len(fields) < 3 or fields[2] not in pytz.all_timezones_set:
+                continue
+            coords = fields[1]
+            split_at = max(coords.rfind("+"), coords.rfind("-"))
+            latitude = parse_coordinate(coords[:split_at], 2)
+            longitude = parse_coordinate(coords[split_at:], 3)
+            locations.append((latitude, longitude, fields[2]))
+    locations.extend((latitude, longitude, zone) for _, zone, latitude, longitude in CITY_LOCATIONS)
+    return locations
+
+def nearest_timezones(latitude, longitude, limit=5):
+    # Ближайший главный город зоны у границы часто оказывается за ней (Сочи -> Тбилиси),
+    # поэтому возвращаем несколько кандидатов, а выбирает пользователь
+    def distance(location):
+        lat, lon, _ = location
+        dlon = (lon - longitude + 180) % 360 - 180
+        return (lat - latitude) ** 2 + (dlon * cos(radians(latitude))) ** 2
+
+    found = []
+    for _, _, zone in sorted(zone_locations(), key=distance):
+        if zone not in found:
+            found.append(zone)
+        if len(found) >= limit:
+            break
+    return found
@@ -0,0 +1,53 @@
+import asyncio
+import sys
+from telegram.ext import BaseUpdateProcessor
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    # Обновления разных пользователей идут параллельно, одного пользователя - по очереди,
+    # чтобы диалоги ConversationHandler и черновики в reminder.json не перемешивались.
+    # BaseUpdateProcessor.process_update занимает свой семафор до do_process_update, и
+    # ожидающие очереди обновления одного пользователя заняли бы все места. Поэтому семафор
+    # базового класса не ограничивает, а лимит берется уже после блокировки пользователя
+    def __init__(self, max_concurrent_updates, admit=None):
+        super().__init__(sys.maxsize)
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates must be a positive integer")
+        self.limit = max_concurrent_updates
+        self.slots = asyncio.Semaphore(max_concurrent_updates)
+        self.admit = admit  # async (update) -> bool, вызывается до очереди пользователя
+        self.in_flight = 0
+        self.user_locks = {}  # user_id -> [asyncio.Lock, число ожидающих обновлений]
+
+    async def do_process_update(self, update, coroutine):
+        if self.admit is not None and not await self.admit(update):
+            coroutine.close()
+            return
+
+        user = getattr(update, "effective_user", None)
+        if user is None:
+            await self.run(coroutine)
+            return
+
+        entry = self.user_locks.setdefault(user.id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self.run(coroutine)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.user_locks[user.id]
+
+    async def run(self, coroutine):
+        async with self.slots:
+            self.in_flight += 1
+            try:
+                await coroutine
+            finally:
+                self.in_flight -= 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass